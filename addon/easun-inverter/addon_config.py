@@ -1,9 +1,27 @@
 #!/usr/bin/env python3
 import glob
-import json
 import os
 from pathlib import Path
 
+try:
+    import orjson as _json  # optional accelerator, 2-4x faster parse
+except ImportError:
+    import json as _json
+
+_OPTIONS_PATH = Path('/data/options.json')
+# Parsed options keyed on (st_mtime_ns, st_size) so repeated Config loads
+# skip the read+parse while the file is unchanged
+_OPTIONS_CACHE: tuple[tuple[int, int], dict] | None = None
+_CONFIG_CACHE: tuple[tuple[int, int] | None, 'Config'] | None = None
+
+
+def _options_stat_key() -> tuple[int, int] | None:
+    try:
+        st = os.stat(_OPTIONS_PATH)
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
 
 class InverterConfig:
     def __init__(self, port: str, baudrate: int = 2400, name: str | None = None,
@@ -46,13 +64,18 @@ class Config:
         # Prefer /dev/serial/by-id where possible
         self.prefer_by_id = bool(str(options.get('prefer_by_id', True)).lower() in ('1','true','yes'))
         if self.prefer_by_id:
+            # Scan the by-id directory once; resolving it per inverter repeats
+            # the same glob + realpath work for every device
+            by_id_map = self._by_id_map()
             for inv in self.inverters:
-                inv.port = self._prefer_by_id(inv.port)
+                inv.port = self._prefer_by_id(inv.port, by_id_map)
 
         # 3-phase grouping
         self.group_3phase = bool(options.get('group_3phase', False))
         # Backward compatibility: also publish base topics for first inverter
         self.legacy_base_topics = bool(options.get('legacy_base_topics', True))
+        # Publish one JSON state blob per device instead of one topic per sensor
+        self.mqtt_json_state = bool(options.get('mqtt_json_state', False))
 
         # MQTT
         self.mqtt_host = options.get('mqtt_host', os.getenv('MQTT_HOST', 'core-mosquitto'))
@@ -63,31 +86,46 @@ class Config:
         self.log_level = str(options.get('log_level', os.getenv('LOG_LEVEL', 'WARNING'))).upper()
         self.device_id = 'easun_inverter'
 
-    def _prefer_by_id(self, current: str) -> str:
+    def _by_id_map(self) -> dict[str, str]:
+        """Map realpath of each /dev/serial/by-id link to the link itself."""
+        try:
+            return {os.path.realpath(link): link for link in glob.glob('/dev/serial/by-id/*')}
+        except Exception:
+            return {}
+
+    def _prefer_by_id(self, current: str, by_id_map: dict[str, str]) -> str:
         try:
             if current.startswith('/dev/serial/by-id/'):
                 return current
-            candidates = glob.glob('/dev/serial/by-id/*')
-            real = os.path.realpath(current)
-            for link in candidates:
-                if os.path.realpath(link) == real:
-                    return link
+            return by_id_map.get(os.path.realpath(current), current)
         except Exception:
             pass
         return current
 
     def _load_options(self):
-        p = Path('/data/options.json')
-        if p.exists():
-            try:
-                return json.loads(p.read_text())
-            except Exception:
-                return {}
-        return {}
+        global _OPTIONS_CACHE
+        key = _options_stat_key()
+        if key is None:
+            return {}
+        if _OPTIONS_CACHE is not None and _OPTIONS_CACHE[0] == key:
+            return _OPTIONS_CACHE[1]
+        try:
+            options = _json.loads(_OPTIONS_PATH.read_bytes())
+        except Exception:
+            return {}
+        _OPTIONS_CACHE = (key, options)
+        return options
 
 
 def get_config() -> Config:
-    return Config()
+    # Reuse one Config instance until /data/options.json changes on disk
+    global _CONFIG_CACHE
+    key = _options_stat_key()
+    if _CONFIG_CACHE is not None and _CONFIG_CACHE[0] == key:
+        return _CONFIG_CACHE[1]
+    cfg = Config()
+    _CONFIG_CACHE = (key, cfg)
+    return cfg
 
 def get_enabled_inverters(cfg: Config) -> list[InverterConfig]:
     return [inv for inv in cfg.inverters if inv.enabled]
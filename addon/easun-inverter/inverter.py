@@ -1,22 +1,149 @@
 #!/usr/bin/env python3
-import json
 import logging
 import os
 import time
 from typing import Dict, List, Optional
 
 import serial
-import re
 
-from protocol_helpers import build_command
+try:
+    import orjson as _json  # optional accelerator, 2-4x faster parse
+except ImportError:
+    import json as _json
+
+from protocol_helpers import build_command, verify_response
 
 
 logger = logging.getLogger(__name__)
 
+# Deletion tables for str.translate: single C-level pass per token, no regex VM.
+# PI30 responses are plain ASCII, so mapping the first 256 codepoints suffices.
+_KEEP_NUMERIC = {c: None for c in range(256)}
+for _c in b"0123456789+-.":
+    _KEEP_NUMERIC[_c] = _c
+_KEEP_DIGITS = {c: None for c in range(256)}
+for _c in b"0123456789":
+    _KEEP_DIGITS[_c] = _c
+del _c
+
+# PI30 QPIGS mapping (indices 0..20)
+_QPIGS_FIELD_KEYS = (
+    'ac_input_voltage_v',            # 0
+    'ac_input_frequency_hz',         # 1
+    'ac_output_voltage_v',           # 2
+    'ac_output_frequency_hz',        # 3
+    'ac_output_apparent_power_va',   # 4
+    'ac_output_active_power_w',      # 5
+    'ac_output_load_percent',        # 6
+    'bus_voltage_v',                 # 7
+    'battery_voltage_v',             # 8
+    'battery_charging_current_a',    # 9
+    'battery_capacity_percent',      # 10
+    'inverter_heatsink_temp_c',      # 11
+    'pv_input_current_a',            # 12
+    'pv_input_voltage_v',            # 13
+    'battery_voltage_scc_v',         # 14
+    'battery_discharge_current_a',   # 15
+    'device_status_bits',            # 16 (8-bit ascii flags)
+    'rsv1',                          # 17
+    'rsv2',                          # 18
+    'pv_input_power_w',              # 19
+    'device_status2_bits',           # 20 (3-bit ascii flags)
+)
+_QPIGS_INT_KEYS = frozenset({
+    'ac_output_apparent_power_va', 'ac_output_active_power_w', 'ac_output_load_percent',
+    'battery_charging_current_a', 'battery_capacity_percent', 'inverter_heatsink_temp_c',
+    'battery_discharge_current_a', 'rsv1', 'rsv2', 'pv_input_power_w', 'bus_voltage_v',
+})
+_QPIGS_STATUS_KEYS = frozenset({'device_status_bits', 'device_status2_bits'})
+
+# Optional PV2 metrics (QPIGS2, PI30MAX/MST)
+_QPIGS2_FIELD_KEYS = ('pv2_input_current_a', 'pv2_input_voltage_v', 'pv2_input_power_w')
+_QPIGS2_INT_KEYS = frozenset({'pv2_input_power_w'})
+
+# Boolean flags derived from the ascii status-bit fields: (key, bit index)
+_STATUS_BITS = (
+    ('status_sbu_priority_added', 0),
+    ('status_configuration_changed', 1),
+    ('status_scc_fw_updated', 2),
+    ('status_load_on', 3),
+    ('status_batt_steady_while_charging', 4),
+    ('status_charging_on', 5),
+    ('status_scc_charging_on', 6),
+    ('status_ac_charging_on', 7),
+)
+_STATUS2_BITS = (
+    ('status_charging_to_float', 0),
+    ('status_switched_on', 1),
+)
+
+# Minimal default mapping used when inverter_map.json is absent; tuples so a
+# shared instance cannot be mutated by accident
+_DEFAULT_MAP: Dict[str, tuple] = {"QPIGS": (
+    "grid_voltage", "grid_power", "grid_frequency", "grid_current",
+    "ac_output_voltage", "ac_output_power", "ac_output_frequency", "ac_output_current",
+    "output_load_percent",
+    "p_bus_voltage", "s_bus_voltage",
+    "p_battery_voltage", "n_battery_voltage",
+    "battery_capacity",
+    "pv_input_power_1", "pv_input_power_2", "pv_input_power_3",
+    "pv_input_voltage_1", "pv_input_voltage_2", "pv_input_voltage_3",
+    "max_temperature_of_detecting_pointers"
+)}
+
+def _parse_pi30(payload: str, keys: tuple, int_keys: frozenset,
+                status_keys: frozenset = frozenset()) -> Dict[str, float]:
+    """Parse a space-separated PI30 payload positionally against keys.
+
+    Single pass: tokenize, sanitize and type-convert without interim lists.
+    Status-bit fields keep their digit string; unparsable tokens are skipped.
+    """
+    data: Dict[str, float] = {}
+    for tok, key in zip(payload.split(), keys):
+        if key in status_keys:
+            data[key] = tok.translate(_KEEP_DIGITS)
+            continue
+        val_s = tok.translate(_KEEP_NUMERIC)
+        try:
+            if key in int_keys:
+                # int() on decimal tokens like '50.0' would raise and
+                # silently drop the field; route those through float()
+                data[key] = int(val_s) if '.' not in val_s else int(float(val_s))
+            else:
+                data[key] = float(val_s)
+        except ValueError:
+            continue
+    return data
+
+
+def _safe_int(tokens: List[str], idx: int) -> Optional[int]:
+    """Sanitize tokens[idx] and parse as int; None when absent or unparsable."""
+    if idx < len(tokens):
+        t = tokens[idx].translate(_KEEP_NUMERIC)
+        try:
+            return int(t) if '.' not in t else int(float(t))
+        except ValueError:
+            return None
+    return None
+
+
+def _safe_float(tokens: List[str], idx: int) -> Optional[float]:
+    """Sanitize tokens[idx] and parse as float; None when absent or unparsable."""
+    if idx < len(tokens):
+        try:
+            return float(tokens[idx].translate(_KEEP_NUMERIC))
+        except ValueError:
+            return None
+    return None
+
 
 class Inverter:
     """EASUN/Voltronic inverter client using PI protocol over serial/USB."""
 
+    # Parsed map files shared across instances, keyed on (path, mtime); the
+    # value tuples are immutable so no instance can corrupt another's view
+    _MAP_CACHE: Dict[tuple, Dict[str, tuple]] = {}
+
     def __init__(self, port: str, baudrate: int = 2400, timeout: float = 3.0, map_path: str = '/app/inverter_map.json'):
         self.port_path = port
         self.baudrate = baudrate
@@ -24,31 +151,31 @@ class Inverter:
         self._ser: Optional[serial.Serial] = None
         self._map = self._load_map(map_path)
 
-    def _load_map(self, path: str) -> Dict[str, List[str]]:
+    @classmethod
+    def _load_map(cls, path: str) -> Dict[str, tuple]:
+        try:
+            st = os.stat(path)
+        except OSError:
+            # Common in dev/container variants: no file, no parse to do
+            return _DEFAULT_MAP
+        key = (path, st.st_mtime_ns)
+        cached = cls._MAP_CACHE.get(key)
+        if cached is not None:
+            return cached
         try:
-            if os.path.exists(path):
-                with open(path, 'r') as f:
-                    data = json.load(f)
-                    if isinstance(data, dict):
-                        return {k: list(v) for k, v in data.items()}
+            with open(path, 'rb') as f:
+                data = _json.loads(f.read())
+            if isinstance(data, dict):
+                result = {k: tuple(v) for k, v in data.items()}
+                cls._MAP_CACHE[key] = result
+                return result
         except Exception as e:
-            logger.warning(f"Map load failed: {e}")
-        # minimal default mapping
-        return {"QPIGS": [
-            "grid_voltage", "grid_power", "grid_frequency", "grid_current",
-            "ac_output_voltage", "ac_output_power", "ac_output_frequency", "ac_output_current",
-            "output_load_percent",
-            "p_bus_voltage", "s_bus_voltage",
-            "p_battery_voltage", "n_battery_voltage",
-            "battery_capacity",
-            "pv_input_power_1", "pv_input_power_2", "pv_input_power_3",
-            "pv_input_voltage_1", "pv_input_voltage_2", "pv_input_voltage_3",
-            "max_temperature_of_detecting_pointers"
-        ]}
+            logger.warning("Map load failed: %s", e)
+        return _DEFAULT_MAP
 
     def open(self) -> None:
         self._ser = serial.Serial(self.port_path, baudrate=self.baudrate, timeout=self.timeout)
-        logger.info(f"Opened serial port {self.port_path} @ {self.baudrate} baud")
+        logger.info("Opened serial port %s @ %s baud", self.port_path, self.baudrate)
         try:
             # Some adapters/inverters need DTR/RTS toggle to wake
             self._ser.dtr = False
@@ -73,23 +200,31 @@ class Inverter:
 
     def _readline(self) -> str:
         assert self._ser
-        line = self._ser.readline()
+        # PI responses terminate with CR; read_until returns as soon as it
+        # arrives instead of waiting out the full port timeout
+        line = self._ser.read_until(expected=b'\r', size=256)
+        if not line:
+            return ''
+        # Drop corrupt frames (noisy USB-serial, inverter startup) before any
+        # parse work; an empty return lets query() retry
+        if not verify_response(line):
+            logger.debug("CRC mismatch, dropping frame: %r", line)
+            return ''
         try:
             return line.decode('utf-8', errors='ignore').strip()
         except Exception:
             return ''
 
-    def query(self, cmd: str, retries: int = 2, delay: float = 0.1) -> Optional[str]:
+    def query(self, cmd: str, retries: int = 2) -> Optional[str]:
         for attempt in range(retries + 1):
             try:
                 self._write(cmd)
-                time.sleep(delay)
                 resp = self._readline()
                 if resp:
                     return resp
             except Exception as e:
-                logger.debug(f"Query {cmd} error: {e}")
-                time.sleep(0.2)
+                logger.debug("Query %s error: %s", cmd, e)
+                time.sleep(0.02)
         return None
 
     def query_qmod(self) -> Dict[str, str]:
@@ -99,8 +234,8 @@ class Inverter:
         if not line:
             return out
         # Response typically like: (L) or (B) etc.
-        if line.startswith('(') and ')' in line:
-            code = line[1:line.find(')')]
+        if line.startswith('('):
+            code = line[1:].partition(')')[0]
         else:
             code = line.strip()
         mode_map = {
@@ -120,47 +255,27 @@ class Inverter:
     def query_q1(self) -> Dict[str, float | str]:
         """Query extended status (Q1) for temps, SCC charge power, sync frequency, charge stage."""
         out: Dict[str, float | str] = {}
-        line = self.query('Q1', retries=1, delay=0.15)
+        line = self.query('Q1', retries=1)
         if not line:
             return out
         # Extract payload inside parentheses
         if line.startswith('('):
-            payload = line[1:line.find(')')] if ')' in line else line[1:]
+            payload = line[1:].partition(')')[0]
         else:
             payload = line
         tokens = [t for t in payload.strip().split(' ') if t]
-        # Helper to safe-int/float
-        def as_int(idx: int) -> Optional[int]:
-            if idx < len(tokens):
-                t = re.sub(r"[^0-9+\-.]", "", tokens[idx])
-                try:
-                    return int(t)
-                except Exception:
-                    try:
-                        return int(float(t))
-                    except Exception:
-                        return None
-            return None
-        def as_float(idx: int) -> Optional[float]:
-            if idx < len(tokens):
-                t = re.sub(r"[^0-9+\-.]", "", tokens[idx])
-                try:
-                    return float(t)
-                except Exception:
-                    return None
-            return None
         # According to PI30 mapping (1-based in docs), approximate indices (0-based here)
-        out['scc_pwm_temp_c'] = as_int(5) or 0
-        out['inverter_temp_c'] = as_int(6) or 0
-        out['battery_temp_c'] = as_int(7) or 0
-        out['transformer_temp_c'] = as_int(8) or 0
-        out['scc_charge_power_w'] = as_int(13) or 0
-        sf = as_float(15)
+        out['scc_pwm_temp_c'] = _safe_int(tokens, 5) or 0
+        out['inverter_temp_c'] = _safe_int(tokens, 6) or 0
+        out['battery_temp_c'] = _safe_int(tokens, 7) or 0
+        out['transformer_temp_c'] = _safe_int(tokens, 8) or 0
+        out['scc_charge_power_w'] = _safe_int(tokens, 13) or 0
+        sf = _safe_float(tokens, 15)
         if sf is not None:
             out['sync_frequency_hz'] = sf
         # Charge status (index 16 usually string like '10','11','12','13')
         if 16 < len(tokens):
-            status_code = re.sub(r"[^0-9]", "", tokens[16])
+            status_code = tokens[16].translate(_KEEP_DIGITS)
             charge_map = {
                 '10': 'nocharging',
                 '11': 'bulk',
@@ -173,38 +288,28 @@ class Inverter:
     def query_qpiri(self) -> Dict[str, float | int | str]:
         """Query current settings (QPIRI) and parse primary fields."""
         out: Dict[str, float | int | str] = {}
-        line = self.query('QPIRI', retries=1, delay=0.15)
+        line = self.query('QPIRI', retries=1)
         if not line:
             return out
         if line.startswith('('):
-            payload = line[1:line.find(')')] if ')' in line else line[1:]
+            payload = line[1:].partition(')')[0]
         else:
             payload = line
         tokens = [t for t in payload.strip().split(' ') if t]
-        def f(i):
-            try:
-                return float(tokens[i])
-            except Exception:
-                return None
-        def iv(i):
-            try:
-                return int(float(tokens[i]))
-            except Exception:
-                return None
         # Map first dozen fields commonly present
         if len(tokens) >= 12:
-            out['qpiri_ac_input_voltage_v'] = f(0)
-            out['qpiri_ac_input_current_a'] = f(1)
-            out['qpiri_ac_output_voltage_v'] = f(2)
-            out['qpiri_ac_output_frequency_hz'] = f(3)
-            out['qpiri_ac_output_current_a'] = f(4)
-            out['qpiri_ac_output_apparent_power_va'] = iv(5)
-            out['qpiri_ac_output_active_power_w'] = iv(6)
-            out['qpiri_battery_voltage_v'] = f(7)
-            out['qpiri_battery_recharge_voltage_v'] = f(8)
-            out['qpiri_battery_under_voltage_v'] = f(9)
-            out['qpiri_battery_bulk_charge_voltage_v'] = f(10)
-            out['qpiri_battery_float_charge_voltage_v'] = f(11)
+            out['qpiri_ac_input_voltage_v'] = _safe_float(tokens, 0)
+            out['qpiri_ac_input_current_a'] = _safe_float(tokens, 1)
+            out['qpiri_ac_output_voltage_v'] = _safe_float(tokens, 2)
+            out['qpiri_ac_output_frequency_hz'] = _safe_float(tokens, 3)
+            out['qpiri_ac_output_current_a'] = _safe_float(tokens, 4)
+            out['qpiri_ac_output_apparent_power_va'] = _safe_int(tokens, 5)
+            out['qpiri_ac_output_active_power_w'] = _safe_int(tokens, 6)
+            out['qpiri_battery_voltage_v'] = _safe_float(tokens, 7)
+            out['qpiri_battery_recharge_voltage_v'] = _safe_float(tokens, 8)
+            out['qpiri_battery_under_voltage_v'] = _safe_float(tokens, 9)
+            out['qpiri_battery_bulk_charge_voltage_v'] = _safe_float(tokens, 10)
+            out['qpiri_battery_float_charge_voltage_v'] = _safe_float(tokens, 11)
         return out
 
     def query_fw_sn(self) -> Dict[str, str]:
@@ -213,8 +318,8 @@ class Inverter:
         def parse_simple(resp: Optional[str]) -> Optional[str]:
             if not resp:
                 return None
-            if resp.startswith('(') and ')' in resp:
-                return resp[1:resp.find(')')].strip()
+            if resp.startswith('('):
+                return resp[1:].partition(')')[0].strip()
             return resp.strip()
         outv = parse_simple(self.query('QVFW'))
         if outv:
@@ -241,107 +346,54 @@ class Inverter:
         # Extract payload inside parentheses (ignore trailing CRC bytes)
         if line.startswith('('):
             line = line[1:]
-        if ')' in line:
-            line = line.split(')')[0]
-        # Tokenize and sanitize numeric tokens
-        raw_parts = [p for p in line.strip().split(' ') if p]
-        parts: List[str] = []
-        for tok in raw_parts:
-            cleaned = re.sub(r"[^0-9+\-.]", "", tok)
-            parts.append(cleaned)
-
-        # PI30 QPIGS mapping (indices 0..20)
-        field_keys: List[str] = [
-            'ac_input_voltage_v',            # 0
-            'ac_input_frequency_hz',         # 1
-            'ac_output_voltage_v',           # 2
-            'ac_output_frequency_hz',        # 3
-            'ac_output_apparent_power_va',   # 4
-            'ac_output_active_power_w',      # 5
-            'ac_output_load_percent',        # 6
-            'bus_voltage_v',                 # 7
-            'battery_voltage_v',             # 8
-            'battery_charging_current_a',    # 9
-            'battery_capacity_percent',      # 10
-            'inverter_heatsink_temp_c',      # 11
-            'pv_input_current_a',            # 12
-            'pv_input_voltage_v',            # 13
-            'battery_voltage_scc_v',         # 14
-            'battery_discharge_current_a',   # 15
-            'device_status_bits',            # 16 (8-bit ascii flags)
-            'rsv1',                          # 17
-            'rsv2',                          # 18
-            'pv_input_power_w',              # 19
-            'device_status2_bits',           # 20 (3-bit ascii flags)
-        ]
-
-        data: Dict[str, float] = {}
-        for i, key in enumerate(field_keys):
-            if i >= len(parts):
-                break
-            val_s = parts[i]
-            if key in ('device_status_bits', 'device_status2_bits'):
-                data[key] = val_s
-                continue
-            try:
-                if key in ('ac_output_apparent_power_va', 'ac_output_active_power_w', 'ac_output_load_percent',
-                           'battery_charging_current_a', 'battery_capacity_percent', 'inverter_heatsink_temp_c',
-                           'battery_discharge_current_a', 'rsv1', 'rsv2', 'pv_input_power_w', 'bus_voltage_v'):
-                    data[key] = int(val_s)
-                else:
-                    data[key] = float(val_s)
-            except Exception:
-                continue
-
-        # Derive useful boolean flags from device_status_bits
-        bits = str(data.get('device_status_bits', ''))
-        if len(bits) == 8 and bits.isdigit():
-            try:
-                data['status_sbu_priority_added'] = bits[0] == '1'
-                data['status_configuration_changed'] = bits[1] == '1'
-                data['status_scc_fw_updated'] = bits[2] == '1'
-                data['status_load_on'] = bits[3] == '1'
-                data['status_batt_steady_while_charging'] = bits[4] == '1'
-                data['status_charging_on'] = bits[5] == '1'
-                data['status_scc_charging_on'] = bits[6] == '1'
-                data['status_ac_charging_on'] = bits[7] == '1'
-            except Exception:
-                pass
-        bits2 = str(data.get('device_status2_bits', ''))
-        if len(bits2) == 3 and bits2.isdigit():
-            data['status_charging_to_float'] = bits2[0] == '1'
-            data['status_switched_on'] = bits2[1] == '1'
+        line = line.partition(')')[0]
+        data = _parse_pi30(line, _QPIGS_FIELD_KEYS, _QPIGS_INT_KEYS, _QPIGS_STATUS_KEYS)
+
+        # Derive useful boolean flags from device_status_bits; the fields are
+        # digit-sanitized at store time, so a length check is all we need
+        bits = data.get('device_status_bits', '')
+        if len(bits) == 8:
+            data.update({k: bits[i] == '1' for k, i in _STATUS_BITS})
+        bits2 = data.get('device_status2_bits', '')
+        if len(bits2) == 3:
+            data.update({k: bits2[i] == '1' for k, i in _STATUS2_BITS})
 
         return data
 
+    def query_qpigs2(self) -> Dict[str, float]:
+        """Query optional PV2 metrics via QPIGS2 if supported (PI30MAX/MST)."""
+        out: Dict[str, float] = {}
+        try:
+            line = self.query('QPIGS2')
+            if line and line.startswith('('):
+                payload = line[1:].partition(')')[0]
+                out = _parse_pi30(payload, _QPIGS2_FIELD_KEYS, _QPIGS2_INT_KEYS)
+        except Exception:
+            pass
+        return out
+
     def read_snapshot(self) -> Dict[str, float]:
         """Read a single snapshot using QPIGS."""
         line = self.query('QPIGS')
         if not line:
             return {}
         data = self.parse_qpigs(line)
-        # Try optional PV2 metrics via QPIGS2 if supported (PI30MAX/MST)
-        try:
-            line2 = self.query('QPIGS2')
-            if line2 and line2.startswith('('):
-                # Extract until ')'
-                payload = line2[1:line2.find(')')] if ')' in line2 else line2[1:]
-                parts = [p for p in payload.strip().split(' ') if p]
-                # Sanitize tokens
-                parts = [re.sub(r"[^0-9+\-.]", "", t) for t in parts]
-                if len(parts) >= 3:
-                    try:
-                        data['pv2_input_current_a'] = float(parts[0])
-                    except Exception:
-                        pass
-                    try:
-                        data['pv2_input_voltage_v'] = float(parts[1])
-                    except Exception:
-                        pass
-                    try:
-                        data['pv2_input_power_w'] = int(float(parts[2]))
-                    except Exception:
-                        pass
-        except Exception:
-            pass
+        data.update(self.query_qpigs2())
         return data
+
+
+
+def sum_snapshots(snapshots: List[Dict[str, float]], keys: tuple) -> Dict[str, float]:
+    """Sum the given numeric fields across snapshots in one pass.
+
+    Intended for 3-phase aggregation: totals the requested keys over all
+    snapshots without building intermediate structures. Missing or
+    non-numeric fields contribute 0.
+    """
+    totals: Dict[str, float] = dict.fromkeys(keys, 0)
+    for snap in snapshots:
+        for k in keys:
+            v = snap.get(k)
+            if isinstance(v, (int, float)) and not isinstance(v, bool):
+                totals[k] += v
+    return totals
@@ -1,18 +1,91 @@
 #!/usr/bin/env python3
+import itertools
 import logging
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 
-from addon_config import get_config, get_enabled_inverters
-from inverter import Inverter
+from addon_config import InverterConfig, get_config, get_enabled_inverters
+from inverter import Inverter, sum_snapshots
 from mqtt_helper import InverterMQTT
 
 
+_ALL_PHASES = frozenset(('L1', 'L2', 'L3'))
+# Snapshot fields totalled for the 3-phase aggregator
+_AGG_KEYS = ('ac_output_active_power_w', 'ac_output_apparent_power_va',
+             'pv_input_power_w', 'pv2_input_power_w')
+# QPIRI settings are re-read this often per device
+_DAY = 24 * 3600
+
+
 def setup_logging(level: str = 'INFO'):
     log_level = getattr(logging, level.upper(), logging.INFO)
     logging.basicConfig(level=log_level, format='[%(levelname)s] %(message)s', stream=sys.stdout)
 
 
+@dataclass(slots=True)
+class InverterRuntime:
+    """Per-device state for the poll loop: config, client and precomputed ids."""
+    cfg: InverterConfig
+    inv: Inverter
+    did: str
+    label: str
+
+
+def _device_id(base: str, ic: InverterConfig) -> str:
+    return f"{base}_{(ic.name or ic.port).lower().replace(' ', '_')}"
+
+
+def _cycle_one(rt: InverterRuntime, do_q1: bool, do_qpiri: bool, do_fwsn: bool) -> tuple[dict, list[dict], bool]:
+    """Run one poll cycle's serial traffic for a single inverter.
+
+    Executed in a worker thread; touches only rt.inv's own serial port.
+    Returns the QPIGS snapshot, the extra payloads (QMOD, Q1, FW/SN, QPIRI)
+    to publish, and whether the static FW/SN metadata was fetched, so all
+    MQTT work stays on the main thread.
+    """
+    data: dict = {}
+    extras: list[dict] = []
+    fwsn_ok = False
+    try:
+        data = rt.inv.read_snapshot()
+    except Exception as e:
+        logging.error('Read error (%s): %s', rt.label, e)
+    if not data:
+        return data, extras, fwsn_ok
+    try:
+        mod = rt.inv.query_qmod()
+        if mod:
+            extras.append(mod)
+    except Exception:
+        pass
+    if do_q1:
+        try:
+            q1 = rt.inv.query_q1()
+            if q1:
+                extras.append(q1)
+        except Exception:
+            pass
+    if do_fwsn:
+        # Static metadata: fetched once per device, retried until it succeeds
+        try:
+            fwsn = rt.inv.query_fw_sn()
+            if fwsn:
+                extras.append(fwsn)
+                fwsn_ok = True
+        except Exception:
+            pass
+    if do_qpiri:
+        try:
+            qpiri = rt.inv.query_qpiri()
+            if qpiri:
+                extras.append(qpiri)
+        except Exception:
+            pass
+    return data, extras, fwsn_ok
+
+
 def main():
     cfg = get_config()
     setup_logging(cfg.log_level)
@@ -20,43 +93,61 @@ def main():
     # Prepare inverter configs early (single or multi)
     inv_cfgs = get_enabled_inverters(cfg)
     if getattr(cfg, 'multi_inverter_mode', False) and len(inv_cfgs) > 1:
-        logging.info(f'Multi-inverter mode: {len(inv_cfgs)} devices, interval: {cfg.read_interval}s')
+        logging.info('Multi-inverter mode: %d devices, interval: %ss', len(inv_cfgs), cfg.read_interval)
         for ic in inv_cfgs:
-            logging.info(f" - {ic.name or ic.port}: {ic.port} @ {ic.baudrate} baud, phase: {ic.phase or '-'}")
+            logging.info(' - %s: %s @ %s baud, phase: %s', ic.name or ic.port, ic.port, ic.baudrate, ic.phase or '-')
     else:
         ic0 = inv_cfgs[0] if inv_cfgs else None
-        logging.info(f"Port: {ic0.port if ic0 else '?'} @ {ic0.baudrate if ic0 else '?'} baud, interval: {cfg.read_interval}s")
+        logging.info('Port: %s @ %s baud, interval: %ss', ic0.port if ic0 else '?', ic0.baudrate if ic0 else '?', cfg.read_interval)
 
-    mqtt = InverterMQTT(cfg.mqtt_host, cfg.mqtt_port, cfg.mqtt_username, cfg.mqtt_password, device_id=cfg.device_id)
+    mqtt = InverterMQTT(cfg.mqtt_host, cfg.mqtt_port, cfg.mqtt_username, cfg.mqtt_password, device_id=cfg.device_id,
+                        json_state=getattr(cfg, 'mqtt_json_state', False))
     connected = mqtt.connect(timeout=10)
     if not connected:
         logging.warning('MQTT not connected; will run without publishing')
 
     # Prepare inverter configs
     # Publish discovery per inverter
+    did_3phase = f"{cfg.device_id}_3phase"
+    configured_phases = frozenset(i.phase for i in inv_cfgs if i.phase)
+    # Aggregation is only possible when all three phases are configured;
+    # decided once here so the hot loop need not re-derive it
+    want_3phase = cfg.group_3phase and _ALL_PHASES <= configured_phases
     if connected:
         for ic in inv_cfgs:
-            did = f"{cfg.device_id}_{(ic.name or ic.port).lower().replace(' ','_')}"
-            mqtt.publish_discovery_for_device(did, ic.name or ic.port)
+            mqtt.publish_discovery_for_device(_device_id(cfg.device_id, ic), ic.name or ic.port)
         # If 3-phase grouping requested and phases L1/L2/L3 present, publish aggregator discovery
-        if cfg.group_3phase and {i.phase for i in inv_cfgs} >= {'L1','L2','L3'}:
-            mqtt.publish_discovery_for_device(f"{cfg.device_id}_3phase", "EASUN 3-Phase System")
+        if want_3phase:
+            mqtt.publish_discovery_for_device(did_3phase, "EASUN 3-Phase System")
         # Legacy base discovery for first inverter (backward compatibility)
         if getattr(cfg, 'legacy_base_topics', True) and inv_cfgs:
             mqtt.publish_discovery()
 
-    # Keep process alive; retry on open/read errors for each inverter sequentially
+    # Keep process alive; retry on open/read errors for each inverter.
+    # One worker per device: the reads are wire-bound on independent file
+    # descriptors, so a cycle costs ~one device's wire time instead of N.
+    # A single inverter runs inline with no pool at all
+    pool = ThreadPoolExecutor(max_workers=len(inv_cfgs)) if len(inv_cfgs) > 1 else None
+    # Devices whose FW/SN metadata has been published; survives port reopens
+    fwsn_done: set[str] = set()
     while True:
-        # Build fresh objects each outer loop to recover failures
-        inv_objs = []
-        for ic in inv_cfgs:
-            inv_objs.append((ic, Inverter(ic.port, baudrate=ic.baudrate, timeout=ic.timeout)))
+        # Build fresh objects each outer loop to recover failures; device ids
+        # and labels never change after startup, so compute them here once
+        runtimes = [
+            InverterRuntime(
+                cfg=ic,
+                inv=Inverter(ic.port, baudrate=ic.baudrate, timeout=ic.timeout),
+                did=_device_id(cfg.device_id, ic),
+                label=ic.name or ic.port,
+            )
+            for ic in inv_cfgs
+        ]
         try:
-            for _, inv in inv_objs:
+            for rt in runtimes:
                 try:
-                    inv.open()
+                    rt.inv.open()
                 except Exception as e:
-                    logging.error(f'Failed to open inverter port: {e}')
+                    logging.error('Failed to open inverter port: %s', e)
         except Exception as e:
             time.sleep(5)
             continue
@@ -65,103 +156,90 @@ def main():
             # Periodic counters
             last_qpiri: dict[str, float] = {}
             q1_every = max(30, cfg.read_interval * 2)
+            # Q1 runs every q1_mod cycles; both inputs are constant, so the
+            # ratio is too
+            q1_mod = max(1, int(q1_every / max(1, cfg.read_interval)))
             loop_count = 0
+            # Monotonic deadline keeps the cycle period fixed instead of
+            # read_interval plus however long the serial reads took
+            next_t = time.monotonic()
             while True:
                 loop_count += 1
-                # Accumulate aggregator if 3-phase grouping
-                agg_active = 0
-                agg_apparent = 0
-                agg_pv = 0
+                # Buffer this cycle's state publishes and flush them in one burst
+                if connected:
+                    mqtt.begin_batch()
+                # Snapshots collected for 3-phase aggregation
+                agg_snaps: list[dict] = []
                 phases_present = set()
-                for idx, (ic, inv) in enumerate(inv_objs):
-                    did = f"{cfg.device_id}_{(ic.name or ic.port).lower().replace(' ','_')}"
-                    data = {}
-                    try:
-                        data = inv.read_snapshot()
-                    except Exception as e:
-                        logging.error(f'Read error ({ic.name or ic.port}): {e}')
+                do_q1 = loop_count % q1_mod == 0
+                now = time.time()
+                jobs = []
+                for idx, rt in enumerate(runtimes):
+                    do_qpiri = now - last_qpiri.get(rt.did, 0.0) > _DAY
+                    do_fwsn = rt.did not in fwsn_done
+                    if pool is None:
+                        # Single device: run the cycle inline, no dispatch
+                        jobs.append((idx, rt, do_qpiri,
+                                     _cycle_one(rt, do_q1, do_qpiri, do_fwsn)))
+                    else:
+                        jobs.append((idx, rt, do_qpiri,
+                                     pool.submit(_cycle_one, rt, do_q1, do_qpiri,
+                                                 do_fwsn)))
+                for idx, rt, do_qpiri, job in jobs:
+                    data, extras, fwsn_ok = job if pool is None else job.result()
+                    if fwsn_ok:
+                        fwsn_done.add(rt.did)
                     if data:
-                        short = ', '.join(f'{k}={v}' for k, v in list(data.items())[:6])
-                        logging.info(f"{ic.name or ic.port} QPIGS: {short} ...")
+                        # Build the log snippet only when INFO is actually on;
+                        # islice avoids materializing the whole dict as a list
+                        if logging.getLogger().isEnabledFor(logging.INFO):
+                            short = ', '.join(f'{k}={v}' for k, v in itertools.islice(data.items(), 6))
+                            logging.info('%s QPIGS: %s ...', rt.label, short)
                         if connected:
-                            try:
-                                mqtt.publish_state_for_device(did, data)
-                            except Exception as e:
-                                logging.error(f'MQTT publish error: {e}')
-                            # Legacy base topics for first inverter
-                            if idx == 0 and getattr(cfg, 'legacy_base_topics', True):
+                            legacy = idx == 0 and getattr(cfg, 'legacy_base_topics', True)
+                            for payload in (data, *extras):
                                 try:
-                                    mqtt.publish_state(data)
-                                except Exception:
-                                    pass
-                        # extended queries
-                        try:
-                            mod = inv.query_qmod()
-                            if mod and connected:
-                                mqtt.publish_state_for_device(did, mod)
-                                if idx == 0 and getattr(cfg, 'legacy_base_topics', True):
-                                    mqtt.publish_state(mod)
-                        except Exception:
-                            pass
-                        if (loop_count % max(1, int(q1_every / max(1, cfg.read_interval)))) == 0:
-                            try:
-                                q1 = inv.query_q1()
-                                if q1 and connected:
-                                    mqtt.publish_state_for_device(did, q1)
-                                    if idx == 0 and getattr(cfg, 'legacy_base_topics', True):
-                                        mqtt.publish_state(q1)
-                            except Exception:
-                                pass
-                        # FW/SN once
-                        try:
-                            fwsn = inv.query_fw_sn()
-                            if fwsn and connected:
-                                mqtt.publish_state_for_device(did, fwsn)
-                                if idx == 0 and getattr(cfg, 'legacy_base_topics', True):
-                                    mqtt.publish_state(fwsn)
-                        except Exception:
-                            pass
-                        now = time.time()
-                        last_ts = last_qpiri.get(did, 0.0)
-                        if now - last_ts > 24*3600:
-                            try:
-                                qpiri = inv.query_qpiri()
-                                if qpiri and connected:
-                                    mqtt.publish_state_for_device(did, qpiri)
-                                    if idx == 0 and getattr(cfg, 'legacy_base_topics', True):
-                                        mqtt.publish_state(qpiri)
-                            except Exception:
-                                pass
-                            last_qpiri[did] = now
-                        # aggregate sums
-                        agg_active += int(data.get('ac_output_active_power_w', 0) or 0)
-                        agg_apparent += int(data.get('ac_output_apparent_power_va', 0) or 0)
-                        pv1 = int(data.get('pv_input_power_w', 0) or 0)
-                        pv2 = int(data.get('pv2_input_power_w', 0) or 0)
-                        agg_pv += pv1 + pv2
-                        if ic.phase:
-                            phases_present.add(ic.phase)
+                                    mqtt.publish_state_for_device(rt.did, payload)
+                                    if legacy:
+                                        mqtt.publish_state(payload)
+                                except Exception as e:
+                                    logging.error('MQTT publish error: %s', e)
+                        if do_qpiri:
+                            last_qpiri[rt.did] = now
+                        if want_3phase:
+                            agg_snaps.append(data)
+                            if rt.cfg.phase:
+                                phases_present.add(rt.cfg.phase)
                 # publish aggregator if configured and phases present
-                if cfg.group_3phase and phases_present >= {'L1','L2','L3'} and connected:
-                    agg_id = f"{cfg.device_id}_3phase"
+                if want_3phase and _ALL_PHASES <= phases_present and connected:
+                    totals = sum_snapshots(agg_snaps, _AGG_KEYS)
                     agg_data = {
-                        'total_active_power_w': agg_active,
-                        'total_apparent_power_va': agg_apparent,
-                        'total_pv_power_w': agg_pv,
+                        'total_active_power_w': totals['ac_output_active_power_w'],
+                        'total_apparent_power_va': totals['ac_output_apparent_power_va'],
+                        'total_pv_power_w': totals['pv_input_power_w'] + totals['pv2_input_power_w'],
                         'phases': ','.join(sorted(phases_present)),
                     }
-                    mqtt.publish_state_for_device(agg_id, agg_data)
-                time.sleep(cfg.read_interval)
+                    mqtt.publish_state_for_device(did_3phase, agg_data)
+                if connected:
+                    mqtt.end_batch()
+                next_t += cfg.read_interval
+                sleep_for = next_t - time.monotonic()
+                if sleep_for > 0:
+                    time.sleep(sleep_for)
+                else:
+                    # Cycle overran the interval; rebase instead of catching up
+                    next_t = time.monotonic()
         except KeyboardInterrupt:
             logging.info('Interrupted by user')
             break
         except Exception as e:
-            logging.error(f'Loop error, will reopen port: {e}')
+            logging.error('Loop error, will reopen port: %s', e)
         finally:
-            try:
-                inv.close()
-            except Exception:
-                pass
+            for rt in runtimes:
+                try:
+                    rt.inv.close()
+                except Exception:
+                    pass
 
     try:
         mqtt.disconnect()
@@ -1,28 +1,45 @@
 #!/usr/bin/env python3
 import json
 import logging
-import time
+import threading
 from typing import Dict, Any
 
 import paho.mqtt.client as mqtt
 
+try:
+    import orjson  # optional accelerator; dumps straight to bytes
+    _dumps = orjson.dumps
+except ImportError:
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj).encode()
+
 
 logger = logging.getLogger(__name__)
 
 
 class InverterMQTT:
-    def __init__(self, host: str, port: int, username: str = '', password: str = '', device_id: str = 'easun_inverter'):
+    def __init__(self, host: str, port: int, username: str = '', password: str = '', device_id: str = 'easun_inverter',
+                 json_state: bool = False):
         self.host = host
         self.port = port
         self.username = username
         self.password = password
         self.device_id = device_id
+        # One JSON blob per device per cycle instead of one publish per sensor
+        self.json_state = json_state
+        self._state_blobs: Dict[str, Dict[str, Any]] = {}
+        # State topics formatted once at discovery time, keyed
+        # (device_id, key); saves the f-string build on every publish
+        self._state_topics: Dict[tuple, str] = {}
+        # Pending (topic, payload) tuples while a batch is open; None = publish immediately
+        self._batch: list[tuple[str, Any]] | None = None
         self.client = mqtt.Client()
         if username:
             self.client.username_pw_set(username, password)
         self.client.on_connect = self._on_connect
         self.client.on_disconnect = self._on_disconnect
         self.connected = False
+        self._connected_event = threading.Event()
         self._loop_running = False
         self._availability_topic = f"easun/{self.device_id}/availability"
         try:
@@ -34,32 +51,62 @@ class InverterMQTT:
         self.connected = (rc == 0)
         if self.connected:
             logger.info("✅ MQTT connected")
+            self._connected_event.set()
             try:
                 self.client.publish(self._availability_topic, payload="online", qos=1, retain=True)
             except Exception:
                 pass
         else:
-            logger.error(f"❌ MQTT connect rc={rc}")
+            logger.error("❌ MQTT connect rc=%s", rc)
 
     def _on_disconnect(self, client, userdata, rc):
         self.connected = False
+        self._connected_event.clear()
         logger.info("MQTT disconnected")
 
     def connect(self, timeout: int = 10) -> bool:
         try:
+            self._connected_event.clear()
             self.client.connect(self.host, self.port, 60)
             if not self._loop_running:
                 self.client.loop_start()
                 self._loop_running = True
-            waited = 0.0
-            while waited < timeout and not self.connected:
-                time.sleep(0.2)
-                waited += 0.2
+            # Woken by _on_connect; no polling wakeups and no residual wait
+            # once the broker has answered
+            self._connected_event.wait(timeout)
             return self.connected
         except Exception as e:
-            logger.error(f"MQTT connect error: {e}")
+            logger.error("MQTT connect error: %s", e)
             return False
 
+    def begin_batch(self):
+        """Start buffering state publishes; flush with end_batch()."""
+        self._batch = []
+
+    def end_batch(self):
+        """Publish everything buffered since begin_batch in one burst.
+
+        Sorted by topic so consecutive packets share topic prefixes and land
+        in as few TCP writes as paho can manage.
+        """
+        batch, self._batch = self._batch, None
+        if not batch:
+            return
+        batch.sort(key=lambda item: item[0])
+        for topic, payload in batch:
+            # One bad publish (oversized payload, socket drop) should not
+            # discard the rest of the cycle's values
+            try:
+                self.client.publish(topic, payload)
+            except Exception as e:
+                logger.error("MQTT publish error (%s): %s", topic, e)
+
+    def _publish_state_value(self, topic: str, payload):
+        if self._batch is not None:
+            self._batch.append((topic, payload))
+        else:
+            self.client.publish(topic, payload)
+
     def disconnect(self):
         try:
             self.client.publish(self._availability_topic, payload="offline", qos=1, retain=True)
@@ -183,7 +230,12 @@ class InverterMQTT:
 
     def _publish_sensor_config_for_device(self, device_id: str, device_name: str, key: str, name: str, unit: str, device_class: str | None, base: Dict[str, Any], avail_topic: str):
         discovery_topic = f"homeassistant/sensor/{device_id}/{key}/config"
-        state_topic = f"easun/{device_id}/{key}"
+        if self.json_state:
+            state_topic = f"easun/{device_id}/state"
+            self._state_topics[(device_id, 'state')] = state_topic
+        else:
+            state_topic = f"easun/{device_id}/{key}"
+            self._state_topics[(device_id, key)] = state_topic
         cfg = {
             'name': f"{device_name} {name}",
             'unique_id': f"{device_id}_{key}",
@@ -207,20 +259,45 @@ class InverterMQTT:
             cfg['device_class'] = device_class
         if device_class == 'voltage':
             cfg['suggested_display_precision'] = 3
-        self.client.publish(discovery_topic, json.dumps(cfg), retain=True)
+        if self.json_state:
+            cfg['value_template'] = '{{ value_json.%s }}' % key
+        self.client.publish(discovery_topic, _dumps(cfg), retain=True)
+
+    def publish_state_json(self, device_id: str, data: Dict[str, Any]):
+        """Merge data into the device's state blob and publish it once.
+
+        The blob accumulates across calls so sensors fed by earlier queries
+        (QMOD, Q1, QPIRI) keep their keys present in every publish; the
+        per-cycle MQTT traffic drops from one packet per sensor to one.
+        """
+        blob = self._state_blobs.setdefault(device_id, {})
+        for key, value in data.items():
+            if isinstance(value, float):
+                value = round(value, 3)
+            blob[key] = value
+        topic = self._state_topics.get((device_id, 'state')) or f"easun/{device_id}/state"
+        self._publish_state_value(topic, _dumps(blob))
 
     def publish_state_for_device(self, device_id: str, data: Dict[str, Any]):
+        if self.json_state:
+            self.publish_state_json(device_id, data)
+            return
         for key, value in data.items():
-            topic = f"easun/{device_id}/{key}"
+            topic = self._state_topics.get((device_id, key)) or f"easun/{device_id}/{key}"
             if isinstance(value, float):
                 value = round(value, 3)
-            self.client.publish(topic, str(value))
+            self._publish_state_value(topic, str(value))
 
     def _publish_sensor_config(self, key: str, name: str, unit: str, device_class: str | None, base: Dict[str, Any]):
         device_id = self.device_id
         object_id = key
         discovery_topic = f"homeassistant/sensor/{device_id}/{object_id}/config"
-        state_topic = f"easun/{device_id}/{object_id}"
+        if self.json_state:
+            state_topic = f"easun/{device_id}/state"
+            self._state_topics[(device_id, 'state')] = state_topic
+        else:
+            state_topic = f"easun/{device_id}/{object_id}"
+            self._state_topics[(device_id, object_id)] = state_topic
         cfg = {
             'name': f"EASUN {name}",
             'unique_id': f"{device_id}_{object_id}",
@@ -245,12 +322,17 @@ class InverterMQTT:
         # Suggest 3 decimals for voltages
         if device_class == 'voltage':
             cfg['suggested_display_precision'] = 3
-        self.client.publish(discovery_topic, json.dumps(cfg), retain=True)
+        if self.json_state:
+            cfg['value_template'] = '{{ value_json.%s }}' % key
+        self.client.publish(discovery_topic, _dumps(cfg), retain=True)
 
     def publish_state(self, data: Dict[str, Any]):
+        if self.json_state:
+            self.publish_state_json(self.device_id, data)
+            return
         device_id = self.device_id
         for key, value in data.items():
-            topic = f"easun/{device_id}/{key}"
+            topic = self._state_topics.get((device_id, key)) or f"easun/{device_id}/{key}"
             if isinstance(value, float):
                 value = round(value, 3)
-            self.client.publish(topic, str(value))
+            self._publish_state_value(topic, str(value))
@@ -15,6 +15,7 @@ import argparse
 import glob
 import sys
 import time
+from binascii import crc_hqx
 from typing import Iterable, List
 
 try:
@@ -24,26 +25,9 @@ except Exception as e:  # pragma: no cover
     raise
 
 
-CRC_TABLE = [
-    0x0000, 0x1021, 0x2042, 0x3063,
-    0x4084, 0x50A5, 0x60C6, 0x70E7,
-    0x8108, 0x9129, 0xA14A, 0xB16B,
-    0xC18C, 0xD1AD, 0xE1CE, 0xF1EF,
-]
-
-
 def crc_pi(data: bytes) -> tuple[int, int]:
-    crc = 0
-    for c in data:
-        da = ((crc >> 8) & 0xFF) >> 4
-        crc = (crc << 4) & 0xFFFF
-        index = da ^ (c >> 4)
-        crc ^= CRC_TABLE[index]
-
-        da = ((crc >> 8) & 0xFF) >> 4
-        crc = (crc << 4) & 0xFFFF
-        index = da ^ (c & 0x0F)
-        crc ^= CRC_TABLE[index]
+    # crc_hqx is CRC-16/XMODEM (poly 0x1021) in C; no Python per-byte loop
+    crc = crc_hqx(data, 0)
 
     lo = crc & 0xFF
     hi = (crc >> 8) & 0xFF
@@ -54,10 +38,25 @@ def crc_pi(data: bytes) -> tuple[int, int]:
     return hi, lo
 
 
-def build_command(cmd: str) -> bytes:
+def _build_uncached(cmd: str) -> bytes:
     body = cmd.encode("utf-8")
     hi, lo = crc_pi(body)
-    return body + bytes([hi, lo, 13])
+    # Grow one buffer in place instead of allocating a second bytes object
+    # to concatenate
+    buf = bytearray(body)
+    buf.append(hi)
+    buf.append(lo)
+    buf.append(13)
+    return bytes(buf)
+
+
+# Default probe commands framed once; --repeat loops then skip the CRC work
+KNOWN_CMDS = ("QPI", "QID", "QPIGS", "QPIGS2", "QMOD", "Q1", "QPIRI")
+_FRAMED = {cmd: _build_uncached(cmd) for cmd in KNOWN_CMDS}
+
+
+def build_command(cmd: str) -> bytes:
+    return _FRAMED.get(cmd) or _build_uncached(cmd)
 
 
 def discover_default_port() -> str:
@@ -73,17 +72,9 @@ def parse_bauds(v: str) -> List[int]:
 
 
 def read_until_cr(ser: serial.Serial, timeout: float = 1.5) -> bytes:
-    end = time.time() + timeout
-    buf = bytearray()
-    while time.time() < end:
-        n = ser.in_waiting
-        if n:
-            buf += ser.read(n)
-            if b"\r" in buf:
-                break
-        else:
-            time.sleep(0.02)
-    return bytes(buf)
+    # Blocks in the kernel until CR or the port timeout set on the Serial
+    # object; no in_waiting polling loop in Python
+    return ser.read_until(expected=b"\r", size=256) or b""
 
 
 def run_probe(port: str, bauds: Iterable[int], cmds: Iterable[str], timeout: float, delay: float, toggle: bool, repeat: int) -> int:
@@ -99,11 +90,18 @@ def run_probe(port: str, bauds: Iterable[int], cmds: Iterable[str], timeout: flo
                     ser.dtr = True
                     ser.rts = True
                     time.sleep(0.05)
+                    ser.reset_input_buffer()
+                stale = False
+                # Frame once per command; memoryview lets pyserial hand the
+                # buffer to os.write without copying on each --repeat pass
+                pkts = [(cmd, memoryview(build_command(cmd))) for cmd in cmds]
                 for _ in range(repeat):
-                    for cmd in cmds:
-                        pkt = build_command(cmd)
-                        ser.reset_input_buffer(); ser.reset_output_buffer()
-                        ser.write(pkt)
+                    for cmd, pkt_mv in pkts:
+                        # Request/response: read_until_cr drains each reply,
+                        # so flush only after a timeout left the line dirty
+                        if stale:
+                            ser.reset_input_buffer()
+                        ser.write(pkt_mv)
                         time.sleep(delay)
                         raw = read_until_cr(ser, timeout)
                         try:
@@ -111,6 +109,10 @@ def run_probe(port: str, bauds: Iterable[int], cmds: Iterable[str], timeout: flo
                         except Exception:
                             text = raw.hex()
                         print(f"{cmd}: {text}")
+                        # A reply without its CR terminator timed out mid-frame;
+                        # the tail may still trickle in, so flush before the
+                        # next command either way
+                        stale = not raw.endswith(b"\r")
                         if text:
                             rc_any = 0
         except Exception as e: